@@ -1,11 +1,43 @@
-import requests
+import httpx
+import orjson
+import threading
+from cachetools import TTLCache
 from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil import parser
 from enum import Enum
 import re
+import functools
 import logging
 
+# Compiled once at import; these run on every booking turn
+_DATE_TOKEN_RE = re.compile(r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}')
+
+# Longest pattern first so "3:30pm" isn't matched as "30pm"
+_TIME_PATTERNS = [
+    re.compile(p) for p in (
+        r'(\d{1,2}):(\d{2})\s*(am|pm)',
+        r'(\d{1,2})\s*(am|pm)',
+        r'(\d{1,2}):(\d{2})',
+    )
+]
+
+_DAYS_MAP = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+    "friday": 4, "saturday": 5, "sunday": 6
+}
+
+def _parse_iso_date(s: str) -> Optional[date]:
+    """
+    Parse a YYYY-MM-DD string without regex or strptime
+    
+    Returns None if the string isn't in that shape; raises ValueError for
+    well-formed but impossible dates (e.g. 2024-02-30).
+    """
+    if len(s) != 10 or s[4] != '-' or s[7] != '-' or not (s[:4] + s[5:7] + s[8:]).isdigit():
+        return None
+    return date(int(s[:4]), int(s[5:7]), int(s[8:]))
+
 class BookingState(Enum):
     INITIAL = "INITIAL"
     SELECT_SPECIALTY = "SELECT_SPECIALTY"
@@ -16,47 +48,109 @@ class BookingState(Enum):
     COMPLETE = "COMPLETE"
     CANCELLED = "CANCELLED"
 
+def create_backend_client(backend_url: str) -> httpx.AsyncClient:
+    """Create the shared HTTP/2 client for backend calls"""
+    # One host, so HTTP/2 multiplexes concurrent lookups over a single connection
+    return httpx.AsyncClient(
+        base_url=backend_url.rstrip('/'),
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=60),
+        headers={"Accept": "application/json"}
+    )
+
+class _BadInput(ValueError):
+    """Invalid caller input, reported as a standard error response"""
+    
+    def __init__(self, message: str, error_code: str):
+        super().__init__(message)
+        self.message = message
+        self.error_code = error_code
+    
+    def to_response(self, data: Any) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "message": self.message,
+            "data": data,
+            "error_code": self.error_code
+        }
+
 class AppointmentManager:
     """Manages multi-turn appointment booking flow"""
     
-    def __init__(self, backend_url: str):
+    def __init__(self, backend_url: str, client: Optional[httpx.AsyncClient] = None):
         self.backend_url = backend_url.rstrip('/')
         self.logger = logging.getLogger(__name__)
+        
+        # Injected by the app at startup so it binds to the server's event loop;
+        # standalone use (scripts, tests) gets its own client on first request
+        self._client = client
+        
+        # Specialists rarely change; doctor details are re-read throughout a booking flow
+        self._cache_lock = threading.Lock()
+        self._spec_cache: TTLCache = TTLCache(maxsize=1, ttl=300)
+        self._doc_cache: TTLCache = TTLCache(maxsize=512, ttl=60)
     
-    def search_doctors(self, keyword: str) -> Dict[str, Any]:
-        """Search for doctors by keyword (name, specialty, city)"""
-        # Validate input
-        if not keyword or not keyword.strip():
-            return {
-                "success": False,
-                "message": "Search keyword cannot be empty",
-                "data": [],
-                "error_code": "INVALID_KEYWORD"
-            }
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Backend client, created on first use if none was injected"""
+        if self._client is None:
+            self._client = create_backend_client(self.backend_url)
+        return self._client
+    
+    @client.setter
+    def client(self, client: httpx.AsyncClient) -> None:
+        self._client = client
+    
+    def clear_caches(self) -> None:
+        """Drop cached specialists and doctor details"""
+        with self._cache_lock:
+            self._spec_cache.clear()
+            self._doc_cache.clear()
+    
+    @staticmethod
+    def _require_nonempty(value: Optional[str], field: str, error_code: str) -> str:
+        """Strip and validate a required input once"""
+        value = (value or "").strip()
+        if not value:
+            raise _BadInput(f"{field} cannot be empty", error_code)
+        return value
+    
+    async def search_doctors(self, keyword: str, limit: int = 10, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Search for doctors by keyword (name, specialty, city)
         
-        keyword = keyword.strip()
-        if len(keyword) < 2:
-            return {
-                "success": False,
-                "message": "Search keyword must be at least 2 characters long",
-                "data": [],
-                "error_code": "KEYWORD_TOO_SHORT"
-            }
+        Args:
+            keyword: Search keyword
+            limit: Maximum number of doctors to return; "total" still counts every match
+            fields: Doctor fields to keep (all fields if None)
+        """
+        # Validate input
+        try:
+            keyword = self._require_nonempty(keyword, "Search keyword", "INVALID_KEYWORD")
+            if len(keyword) < 2:
+                raise _BadInput("Search keyword must be at least 2 characters long", "KEYWORD_TOO_SHORT")
+        except _BadInput as e:
+            return e.to_response([])
         
         try:
-            response = requests.get(
-                f"{self.backend_url}/api/public/search",
-                params={"keyword": keyword},
-                timeout=10
-            )
+            # Ask the backend to trim the payload; enforced below in case it doesn't
+            params = {"keyword": keyword, "limit": limit}
+            if fields:
+                params["fields"] = ",".join(fields)
+            
+            response = await self.client.get("/api/public/search", params=params)
             
             if response.status_code == 200:
-                data = response.json()
-                doctors = data.get("data", [])
+                matches = orjson.loads(response.content).get("data", [])
+                doctors = matches[:limit]
+                if fields:
+                    doctors = [{f: doc.get(f) for f in fields} for doc in doctors]
                 return {
                     "success": True,
-                    "message": f"Found {len(doctors)} doctor(s)",
-                    "data": doctors
+                    "message": f"Found {len(matches)} doctor(s)",
+                    "data": doctors,
+                    "total": len(matches)
                 }
             elif response.status_code == 404:
                 return {
@@ -72,7 +166,7 @@ class AppointmentManager:
                     "data": [],
                     "error_code": "SERVER_ERROR"
                 }
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             self.logger.error("Timeout while searching doctors")
             return {
                 "success": False,
@@ -80,8 +174,8 @@ class AppointmentManager:
                 "data": [],
                 "error_code": "TIMEOUT"
             }
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f"Network error searching doctors: {e}", exc_info=True)
+        except httpx.RequestError as e:
+            self.logger.error("Network error searching doctors: %s", e, exc_info=True)
             return {
                 "success": False,
                 "message": "Unable to connect to the server. Please check your connection.",
@@ -89,7 +183,7 @@ class AppointmentManager:
                 "error_code": "NETWORK_ERROR"
             }
         except Exception as e:
-            self.logger.error(f"Error searching doctors: {e}", exc_info=True)
+            self.logger.error("Error searching doctors: %s", e, exc_info=True)
             return {
                 "success": False,
                 "message": "An unexpected error occurred while searching doctors",
@@ -97,30 +191,34 @@ class AppointmentManager:
                 "error_code": "UNKNOWN_ERROR"
             }
     
-    def get_doctor_by_id(self, doctor_id: str) -> Dict[str, Any]:
+    async def get_doctor_by_id(self, doctor_id: str) -> Dict[str, Any]:
         """Get doctor details by ID"""
         # Validate input
-        if not doctor_id or not doctor_id.strip():
-            return {
-                "success": False,
-                "message": "Doctor ID cannot be empty",
-                "data": None,
-                "error_code": "INVALID_DOCTOR_ID"
-            }
+        try:
+            doctor_id = self._require_nonempty(doctor_id, "Doctor ID", "INVALID_DOCTOR_ID")
+        except _BadInput as e:
+            return e.to_response(None)
+        
+        with self._cache_lock:
+            cached = self._doc_cache.get(doctor_id)
+        if cached is not None:
+            return cached
         
         try:
-            response = requests.get(
-                f"{self.backend_url}/api/public/getDoctor/{doctor_id.strip()}",
-                timeout=10
+            response = await self.client.get(
+                f"/api/public/getDoctor/{doctor_id}"
             )
             
             if response.status_code == 200:
-                data = response.json()
-                return {
+                data = orjson.loads(response.content)
+                result = {
                     "success": True,
                     "message": "Doctor found successfully",
                     "data": data.get("data")
                 }
+                with self._cache_lock:
+                    self._doc_cache[doctor_id] = result
+                return result
             elif response.status_code == 404:
                 return {
                     "success": False,
@@ -135,7 +233,7 @@ class AppointmentManager:
                     "data": None,
                     "error_code": "SERVER_ERROR"
                 }
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             return {
                 "success": False,
                 "message": "Request timeout. Please try again.",
@@ -143,7 +241,7 @@ class AppointmentManager:
                 "error_code": "TIMEOUT"
             }
         except Exception as e:
-            self.logger.error(f"Error getting doctor: {e}", exc_info=True)
+            self.logger.error("Error getting doctor: %s", e, exc_info=True)
             return {
                 "success": False,
                 "message": "An unexpected error occurred while fetching doctor details",
@@ -151,79 +249,56 @@ class AppointmentManager:
                 "error_code": "UNKNOWN_ERROR"
             }
     
-    def get_specialists(self) -> List[Dict]:
+    async def get_specialists(self) -> List[Dict]:
         """Get list of all specialties"""
+        with self._cache_lock:
+            cached = self._spec_cache.get("specialists")
+        if cached is not None:
+            return cached
+        
         try:
-            response = requests.get(
-                f"{self.backend_url}/api/public/getSpecialist",
-                timeout=10
-            )
+            response = await self.client.get("/api/public/getSpecialist")
             
             if response.status_code == 200:
-                data = response.json()
-                return data.get("data", [])
+                data = orjson.loads(response.content)
+                specialists = data.get("data", [])
+                with self._cache_lock:
+                    self._spec_cache["specialists"] = specialists
+                return specialists
             return []
         except Exception as e:
-            self.logger.error(f"Error getting specialists: {e}", exc_info=True)
+            self.logger.error("Error getting specialists: %s", e, exc_info=True)
             return []
     
-    def get_available_slots(self, doctor_id: str, date: str) -> Dict[str, Any]:
+    async def get_available_slots(self, doctor_id: str, date: str) -> Dict[str, Any]:
         """Get available time slots for a doctor on a specific date"""
         # Validate inputs
-        if not doctor_id or not doctor_id.strip():
-            return {
-                "success": False,
-                "message": "Doctor ID cannot be empty",
-                "data": [],
-                "error_code": "INVALID_DOCTOR_ID"
-            }
-        
-        if not date or not date.strip():
-            return {
-                "success": False,
-                "message": "Date cannot be empty",
-                "data": [],
-                "error_code": "INVALID_DATE"
-            }
-        
-        # Validate date format (ISO format YYYY-MM-DD)
-        import re
-        if not re.match(r'^\d{4}-\d{2}-\d{2}$', date.strip()):
-            return {
-                "success": False,
-                "message": "Date must be in YYYY-MM-DD format",
-                "data": [],
-                "error_code": "INVALID_DATE_FORMAT"
-            }
-        
         try:
+            doctor_id = self._require_nonempty(doctor_id, "Doctor ID", "INVALID_DOCTOR_ID")
+            date = self._require_nonempty(date, "Date", "INVALID_DATE")
+            
+            # Validate date format (ISO format YYYY-MM-DD) and value
+            try:
+                date_obj = _parse_iso_date(date)
+            except ValueError:
+                raise _BadInput("Invalid date value", "INVALID_DATE_VALUE")
+            if date_obj is None:
+                raise _BadInput("Date must be in YYYY-MM-DD format", "INVALID_DATE_FORMAT")
+            
             # Validate date is not in the past
-            from datetime import datetime
-            date_obj = datetime.strptime(date.strip(), "%Y-%m-%d").date()
             if date_obj < datetime.now().date():
-                return {
-                    "success": False,
-                    "message": "Cannot book appointments for past dates",
-                    "data": [],
-                    "error_code": "PAST_DATE"
-                }
-        except ValueError:
-            return {
-                "success": False,
-                "message": "Invalid date value",
-                "data": [],
-                "error_code": "INVALID_DATE_VALUE"
-            }
+                raise _BadInput("Cannot book appointments for past dates", "PAST_DATE")
+        except _BadInput as e:
+            return e.to_response([])
         
         try:
-            response = requests.get(
-                f"{self.backend_url}/api/slots",
-                params={"doctorId": doctor_id.strip(), "date": date.strip()},
-                timeout=10
+            response = await self.client.get(
+                "/api/slots",
+                params={"doctorId": doctor_id, "date": date}
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 slots_data = data.get("data", [])
                 
                 # Extract only available slots (status = "AVAILABLE")
@@ -252,7 +327,7 @@ class AppointmentManager:
                     "data": [],
                     "error_code": "SERVER_ERROR"
                 }
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             return {
                 "success": False,
                 "message": "Request timeout. Please try again.",
@@ -260,7 +335,7 @@ class AppointmentManager:
                 "error_code": "TIMEOUT"
             }
         except Exception as e:
-            self.logger.error(f"Error getting slots: {e}", exc_info=True)
+            self.logger.error("Error getting slots: %s", e, exc_info=True)
             return {
                 "success": False,
                 "message": "An unexpected error occurred while fetching available slots",
@@ -268,11 +343,21 @@ class AppointmentManager:
                 "error_code": "UNKNOWN_ERROR"
             }
     
-    def parse_date_from_text(self, text: str) -> Optional[str]:
-        """Parse natural language date into ISO format"""
-        text_lower = text.lower()
-        today = datetime.now().date()
-        
+    def parse_date_from_text(self, text: str, text_lower: Optional[str] = None) -> Optional[str]:
+        """Parse natural language date into ISO format (pass text_lower if already computed)"""
+        return self._parse_date(text_lower if text_lower is not None else text.lower(), datetime.now().date())
+    
+    def parse_time_from_text(self, text: str, text_lower: Optional[str] = None) -> Optional[str]:
+        """Parse natural language time into HH:MM:SS format (pass text_lower if already computed)"""
+        return self._parse_time(text_lower if text_lower is not None else text.lower())
+    
+    # Parsers are pure functions of their arguments, so results are memoized.
+    # The caches are process-local; "today" is part of the date key so relative
+    # dates stay correct across midnight.
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _parse_date(text_lower: str, today: date) -> Optional[str]:
+        """Parse lowercased text into an ISO date relative to today"""
         # Handle relative dates
         if "today" in text_lower:
             return today.isoformat()
@@ -284,12 +369,7 @@ class AppointmentManager:
             return (today + timedelta(days=7)).isoformat()
         
         # Handle specific days
-        days_map = {
-            "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
-            "friday": 4, "saturday": 5, "sunday": 6
-        }
-        
-        for day_name, day_num in days_map.items():
+        for day_name, day_num in _DAYS_MAP.items():
             if day_name in text_lower:
                 days_ahead = day_num - today.weekday()
                 if days_ahead <= 0:
@@ -299,7 +379,7 @@ class AppointmentManager:
         # Try to parse date directly
         try:
             # Extract date-like patterns
-            date_match = re.search(r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}', text)
+            date_match = _DATE_TOKEN_RE.search(text_lower)
             if date_match:
                 parsed_date = parser.parse(date_match.group(), dayfirst=True)
                 return parsed_date.date().isoformat()
@@ -308,20 +388,14 @@ class AppointmentManager:
         
         return None
     
-    def parse_time_from_text(self, text: str) -> Optional[str]:
-        """Parse natural language time into HH:MM:SS format"""
-        text_lower = text.lower()
-        
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _parse_time(text_lower: str) -> Optional[str]:
+        """Parse lowercased text into HH:MM:SS"""
         # Try to find time patterns
         # Pattern: 3pm, 3:30pm, 15:00, etc.
-        time_patterns = [
-            r'(\d{1,2})\s*(am|pm)',
-            r'(\d{1,2}):(\d{2})\s*(am|pm)',
-            r'(\d{1,2}):(\d{2})',
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, text_lower)
+        for pattern in _TIME_PATTERNS:
+            match = pattern.search(text_lower)
             if match:
                 try:
                     if 'am' in text_lower or 'pm' in text_lower:
@@ -345,22 +419,22 @@ class AppointmentManager:
         
         return None
     
-    def extract_booking_info(self, message: str, current_context: Dict) -> Dict:
+    def extract_booking_info(self, message_lower: str, current_context: Dict) -> Dict:
         """
-        Extract booking information from user message
+        Extract booking information from user message (expects lowercased text)
         Updates the booking context with new information found
         """
         updates = {}
         
         # Try to extract date
         if "date" not in current_context or not current_context.get("date"):
-            date = self.parse_date_from_text(message)
+            date = self.parse_date_from_text(message_lower, text_lower=message_lower)
             if date:
                 updates["date"] = date
         
         # Try to extract time
         if "time" not in current_context or not current_context.get("time"):
-            time = self.parse_time_from_text(message)
+            time = self.parse_time_from_text(message_lower, text_lower=message_lower)
             if time:
                 updates["time"] = time
         
@@ -378,9 +452,10 @@ class AppointmentManager:
         if not slots:
             return "No available slots"
         
-        # Group by AM/PM
-        am_slots = [s for s in slots if int(s.split(':')[0]) < 12]
-        pm_slots = [s for s in slots if int(s.split(':')[0]) >= 12]
+        # Group by AM/PM in a single pass (slots are HH:MM:SS)
+        am_slots, pm_slots = [], []
+        for s in slots:
+            (am_slots if int(s[:2]) < 12 else pm_slots).append(s)
         
         result = []
         if am_slots:
@@ -393,7 +468,9 @@ class AppointmentManager:
         
         return "\n".join(result)
     
-    def _format_time_12hr(self, time_24hr: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _format_time_12hr(time_24hr: str) -> str:
         """Convert 24-hour time to 12-hour format"""
         hour, minute, _ = time_24hr.split(':')
         hour = int(hour)
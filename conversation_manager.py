@@ -1,9 +1,21 @@
-import json
+import orjson
 import os
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+import collections
+import logging
+import itertools
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime, timedelta, timezone
 import redis
 
+logger = logging.getLogger(__name__)
+
+# Reserved context hash field holding the session's last_activity in Redis mode
+_LAST_ACTIVITY_FIELD = "_last_activity"
+
+def _now_iso() -> str:
+    """Current UTC time as an ISO-8601 string"""
+    return datetime.now(timezone.utc).isoformat()
+
 class ConversationManager:
     """Manages conversation sessions and history using Redis"""
     
@@ -17,14 +29,15 @@ class ConversationManager:
                 host=redis_host,
                 port=redis_port,
                 password=redis_password,
+                # Reads come back as str (orjson.loads accepts it); writes take orjson's bytes as-is
                 decode_responses=True
             )
             # Test connection
             self.redis_client.ping()
             self.use_redis = True
-            print(f"✓ Connected to Redis at {redis_host}:{redis_port}")
+            logger.info("Connected to Redis at %s:%s", redis_host, redis_port)
         except Exception as e:
-            print(f"⚠ Redis connection failed: {e}. Using in-memory storage.")
+            logger.warning("Redis connection failed: %s. Using in-memory storage.", e)
             self.use_redis = False
             self.memory_storage = {}
     
@@ -36,12 +49,17 @@ class ConversationManager:
         """Generate Redis key for conversation history"""
         return f"chat_history:{user_id}"
     
-    def start_session(self, user_id: str, metadata: Optional[Dict] = None) -> Dict:
+    def _get_context_key(self, user_id: str) -> str:
+        """Generate Redis key for the session context hash"""
+        return f"chat_session:{user_id}:ctx"
+    
+    def start_session(self, user_id: str, metadata: Optional[Dict] = None, *, now_iso: Optional[str] = None) -> Dict:
         """Start a new conversation session"""
+        now_iso = now_iso or _now_iso()
         session_data = {
             "user_id": user_id,
-            "started_at": datetime.now().isoformat(),
-            "last_activity": datetime.now().isoformat(),
+            "started_at": now_iso,
+            "last_activity": now_iso,
             "metadata": metadata or {},
             "context": {}
         }
@@ -49,70 +67,151 @@ class ConversationManager:
         session_key = self._get_session_key(user_id)
         
         if self.use_redis:
-            # Store session with 1 hour expiry
-            self.redis_client.setex(
-                session_key,
-                timedelta(hours=1),
-                json.dumps(session_data)
-            )
+            # Store session metadata with 1 hour expiry; context lives in its own hash
+            metadata_only = {k: v for k, v in session_data.items() if k != "context"}
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(session_key, timedelta(hours=1), orjson.dumps(metadata_only))
+            pipe.delete(self._get_context_key(user_id))
+            pipe.execute()
         else:
             self.memory_storage[session_key] = session_data
         
         return session_data
     
-    def get_session(self, user_id: str) -> Optional[Dict]:
+    def get_session(self, user_id: str, *, now_iso: Optional[str] = None) -> Optional[Dict]:
         """Get existing session or create new one"""
         session_key = self._get_session_key(user_id)
         
         if self.use_redis:
-            session_data = self.redis_client.get(session_key)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(session_key)
+            pipe.hgetall(self._get_context_key(user_id))
+            session_data, context = pipe.execute()
             if session_data:
-                return json.loads(session_data)
+                return self._decode_session(session_data, context)
         else:
             if session_key in self.memory_storage:
                 return self.memory_storage[session_key]
         
         # No active session, create new one
-        return self.start_session(user_id)
+        return self.start_session(user_id, now_iso=now_iso)
     
-    def update_session_context(self, user_id: str, context_updates: Dict) -> None:
-        """Update session context with new information"""
-        session = self.get_session(user_id)
-        session["context"].update(context_updates)
-        session["last_activity"] = datetime.now().isoformat()
+    def _decode_session(self, session_data: str, context: Dict[str, str]) -> Dict:
+        """Rebuild a session dict from its Redis metadata and context hash"""
+        session = orjson.loads(session_data)
+        session["context"] = {k: orjson.loads(v) for k, v in context.items()}
+        # Activity is tracked in the hash so context writes never rewrite the metadata blob
+        last_activity = session["context"].pop(_LAST_ACTIVITY_FIELD, None)
+        if last_activity:
+            session["last_activity"] = last_activity
+        return session
+    
+    def load_context(self, user_id: str, limit: int = 5, *, now_iso: Optional[str] = None) -> Tuple[Dict, List[Dict]]:
+        """Get the session and recent history (oldest first) in a single round-trip"""
+        if self.use_redis:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(self._get_session_key(user_id))
+            pipe.hgetall(self._get_context_key(user_id))
+            pipe.lrange(self._get_history_key(user_id), 0, limit - 1)
+            session_data, context, messages = pipe.execute()
+            
+            # History is stored newest first
+            history = [orjson.loads(msg) for msg in reversed(messages)]
+            if session_data:
+                session = self._decode_session(session_data, context)
+            else:
+                session = self.start_session(user_id, now_iso=now_iso)
+        else:
+            session = self.get_session(user_id, now_iso=now_iso)
+            history = self.get_conversation_history(user_id, limit)
+            history.reverse()
         
-        session_key = self._get_session_key(user_id)
+        return session, history
+    
+    def update_session_context(self, user_id: str, context_updates: Dict, *, now_iso: Optional[str] = None) -> None:
+        """Update session context with new information"""
+        if self.use_redis:
+            self._store_context(user_id, context_updates, now_iso=now_iso)
+        else:
+            self.update_session(user_id, self.get_session(user_id, now_iso=now_iso), context_updates, now_iso=now_iso)
+    
+    def update_session(self, user_id: str, session: Dict, context_updates: Dict, *, now_iso: Optional[str] = None) -> Dict:
+        """Update session context and the caller's copy of the session, returning it without a read-back"""
+        session.setdefault("context", {}).update(context_updates)
+        session["last_activity"] = now_iso = now_iso or _now_iso()
         
         if self.use_redis:
-            self.redis_client.setex(
-                session_key,
-                timedelta(hours=1),
-                json.dumps(session)
-            )
+            self._store_context(user_id, context_updates, now_iso=now_iso)
         else:
-            self.memory_storage[session_key] = session
+            self.memory_storage[self._get_session_key(user_id)] = session
+        return session
     
-    def add_message(self, user_id: str, role: str, content: str, metadata: Optional[Dict] = None) -> None:
-        """Add a message to conversation history"""
+    def _store_context(self, user_id: str, context_updates: Dict, *, now_iso: Optional[str] = None) -> None:
+        """Write changed context fields to Redis"""
+        if not context_updates:
+            return
+        # Only the changed fields go over the wire
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(self._get_context_key(user_id), mapping={k: orjson.dumps(v) for k, v in context_updates.items()})
+        self._touch_session(pipe, user_id, now_iso or _now_iso())
+        pipe.execute()
+    
+    def _touch_session(self, pipe, user_id: str, now_iso: str) -> None:
+        """Queue a last_activity update and TTL refresh for both session keys on a pipeline"""
+        session_key = self._get_session_key(user_id)
+        context_key = self._get_context_key(user_id)
+        # If the metadata key expired, recreate it here; otherwise the next read would call
+        # start_session and wipe the context just written
+        pipe.set(session_key, orjson.dumps({
+            "user_id": user_id,
+            "started_at": now_iso,
+            "last_activity": now_iso,
+            "metadata": {}
+        }), ex=timedelta(hours=1), nx=True)
+        pipe.expire(session_key, timedelta(hours=1))
+        pipe.hset(context_key, _LAST_ACTIVITY_FIELD, orjson.dumps(now_iso))
+        pipe.expire(context_key, timedelta(hours=1))
+    
+    def add_message(self, user_id: str, role: str, content: str, metadata: Optional[Dict] = None, *, now_iso: Optional[str] = None,
+                    count_field: Optional[str] = None, count_by: int = 1) -> Optional[int]:
+        """
+        Add a message to conversation history
+        
+        If count_field is given, that integer in the session context is incremented in the
+        same round-trip and its new value returned.
+        """
+        now_iso = now_iso or _now_iso()
         message = {
             "role": role,  # 'user' or 'assistant'
             "content": content,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now_iso,
             "metadata": metadata or {}
         }
         
         history_key = self._get_history_key(user_id)
         
         if self.use_redis:
-            # Add to list and keep last 50 messages
-            self.redis_client.lpush(history_key, json.dumps(message))
-            self.redis_client.ltrim(history_key, 0, 49)
-            self.redis_client.expire(history_key, timedelta(hours=24))
+            # Add to list and keep last 50 messages, in a single round-trip
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.lpush(history_key, orjson.dumps(message))
+            pipe.ltrim(history_key, 0, 49)
+            pipe.expire(history_key, timedelta(hours=24))
+            if count_field:
+                pipe.hincrby(self._get_context_key(user_id), count_field, count_by)
+                self._touch_session(pipe, user_id, now_iso)
+            results = pipe.execute()
+            return results[3] if count_field else None
         else:
             if history_key not in self.memory_storage:
-                self.memory_storage[history_key] = []
-            self.memory_storage[history_key].insert(0, message)
-            self.memory_storage[history_key] = self.memory_storage[history_key][:50]
+                # Bounded deque: O(1) push at the front, oldest messages drop off automatically
+                self.memory_storage[history_key] = collections.deque(maxlen=50)
+            self.memory_storage[history_key].appendleft(message)
+            
+            if count_field:
+                context = self.get_session(user_id, now_iso=now_iso)["context"]
+                context[count_field] = context.get(count_field, 0) + count_by
+                return context[count_field]
+            return None
     
     def get_conversation_history(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get recent conversation history"""
@@ -120,22 +219,25 @@ class ConversationManager:
         
         if self.use_redis:
             messages = self.redis_client.lrange(history_key, 0, limit - 1)
-            return [json.loads(msg) for msg in messages]
+            return [orjson.loads(msg) for msg in messages]
         else:
             if history_key in self.memory_storage:
-                return self.memory_storage[history_key][:limit]
+                return list(itertools.islice(self.memory_storage[history_key], 0, limit))
             return []
     
     def get_context_string(self, user_id: str, limit: int = 5) -> str:
         """Get conversation history formatted as context string for AI"""
         history = self.get_conversation_history(user_id, limit)
         
+        # Reverse to get chronological order
+        history.reverse()
+        return self.format_context(history)
+    
+    def format_context(self, history: List[Dict]) -> str:
+        """Format chronological history as context string for AI"""
         if not history:
             return ""
         
-        # Reverse to get chronological order
-        history = list(reversed(history))
-        
         context_lines = []
         for msg in history:
             role = "User" if msg["role"] == "user" else "Assistant"
@@ -148,7 +250,7 @@ class ConversationManager:
         session_key = self._get_session_key(user_id)
         
         if self.use_redis:
-            self.redis_client.delete(session_key)
+            self.redis_client.delete(session_key, self._get_context_key(user_id))
         else:
             if session_key in self.memory_storage:
                 del self.memory_storage[session_key]
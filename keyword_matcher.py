@@ -0,0 +1,34 @@
+import re
+from typing import Dict, Iterable, Optional
+
+class KeywordMatcher:
+    """Finds the highest-priority keyword category in a text with one compiled regex scan"""
+    
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        """
+        Args:
+            categories: Category -> keywords, in priority order (first wins)
+        """
+        self.categories = list(categories)
+        
+        alternatives = []
+        for index, keywords in enumerate(categories.values()):
+            # Longest first so a phrase isn't shadowed by one of its prefixes
+            words = sorted(set(keywords), key=len, reverse=True)
+            alternatives.append(f"(?P<c{index}>{'|'.join(map(re.escape, words))})")
+        
+        # Zero-width lookahead reports a match at every position, so overlapping keywords
+        # starting at different positions are all seen; at each position only the
+        # highest-priority category is reported, which is all first() needs
+        self.pattern = re.compile(f"(?=(?:{'|'.join(alternatives)}))")
+    
+    def first(self, text: str) -> Optional[str]:
+        """Highest-priority category with a keyword in text, or None"""
+        best = None
+        for m in self.pattern.finditer(text):
+            index = int(m.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return self.categories[best] if best is not None else None
@@ -1,34 +1,88 @@
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, ValidationError as PydanticValidationError
-from service import AIAgentService
-from models import ChatRequest, ChatResponse, ValidationError
+from service import AIAgentService, BACKEND_URL
+from appointment_manager import create_backend_client
+from models import ChatRequest, ChatResponse, ValidationError, IntentType
+from cachetools import TTLCache
+import hashlib
+import logging
+import logging.handlers
 import os
+import queue
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from typing import Optional
 
 load_dotenv()
 
+# Handlers only enqueue records; a listener thread does the actual stream I/O
+log_queue: queue.Queue = queue.Queue(-1)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+    handlers=[logging.handlers.QueueHandler(log_queue)]
+)
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+logger = logging.getLogger(__name__)
+
 app = FastAPI(
     title="AI Medical Appointment Agent",
     description="Intelligent AI agent for medical appointment booking and patient assistance",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS Configuration
+# Explicit origin list; browsers reject "*" together with credentials anyway
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
+extra_origins = [o.strip() for o in os.getenv("EXTRA_ORIGINS", "").split(",")]
+allow_origins = [o for o in dict.fromkeys([frontend_url, "http://localhost:8080", *extra_origins]) if o]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[frontend_url, "http://localhost:8080", "*"],  # Add backend and allow all for development
-    allow_credentials=True,
+    allow_origins=allow_origins,
+    allow_credentials="*" not in allow_origins,  # Wildcard is only for development, without credentials
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 agent_service = AIAgentService()
 
+# Short-lived cache for repeated turns that don't change session state
+response_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+CACHEABLE_INTENTS = {
+    IntentType.GREETING.value,
+    IntentType.CANCEL_POLICY.value,
+    IntentType.INSURANCE_QUERY.value,
+    IntentType.PATIENT_QUERY.value,
+}
+BOOKING_KEYWORDS = ("book", "appointment", "schedule", "slot", "doctor", "cancel", "policy")
+
+def response_cache_key(user_id: str, message: str) -> Optional[str]:
+    """Build the response cache key, or None if the message shouldn't be cached"""
+    normalized = message.strip().lower()
+    
+    # Long free-form text (usually symptom descriptions) rarely repeats
+    if len(normalized) > 40 and not any(kw in normalized for kw in BOOKING_KEYWORDS):
+        return None
+    
+    return hashlib.blake2b((user_id + "|" + normalized).encode(), digest_size=16).hexdigest()
+
+@app.on_event("startup")
+async def startup_event():
+    """Create the shared backend client on the server's event loop"""
+    app.state.http = create_backend_client(BACKEND_URL)
+    agent_service.appointment_manager.client = app.state.http
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled backend connections"""
+    await app.state.http.aclose()
+    log_listener.stop()
+
 # Custom exception handler for validation errors
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -41,7 +95,7 @@ async def validation_exception_handler(request, exc):
             "error_code": "VALIDATION_ERROR"
         })
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={
             "success": False,
@@ -62,6 +116,8 @@ async def chat_endpoint(request: ChatRequest, authorization: Optional[str] = Hea
     Returns:
         ChatResponse with AI response and metadata
     """
+    now_iso = datetime.now(timezone.utc).isoformat()
+    
     try:
         # Validate request
         if not request.user_id or not request.user_id.strip():
@@ -95,11 +151,23 @@ async def chat_endpoint(request: ChatRequest, authorization: Optional[str] = Hea
         elif request.jwt_token:
             jwt_token = request.jwt_token
         
+        cache_key = response_cache_key(request.user_id, request.message)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            # Keep the conversation history complete even when Gemini is skipped
+            agent_service.record_cached_turn(request.user_id, request.message, cached.response, now_iso=now_iso)
+            return cached
+        
         response = await agent_service.process_message(
             request.user_id, 
             request.message,
-            jwt_token
+            jwt_token,
+            now_iso=now_iso
         )
+        
+        if (cache_key and response.success and not response.requires_action
+                and response.intent in CACHEABLE_INTENTS):
+            response_cache[cache_key] = response
         return response
     except PydanticValidationError as e:
         # Handle Pydantic validation errors
@@ -129,10 +197,8 @@ async def chat_endpoint(request: ChatRequest, authorization: Optional[str] = Hea
                 error_code="VALUE_ERROR"
             )]
         )
-    except Exception as e:
-        print(f"[API Error] {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("chat_endpoint failed")
         return ChatResponse(
             response="An unexpected error occurred. Please try again later.",
             success=False,
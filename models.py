@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Dict, Any, Tuple
 from enum import Enum
 
 class IntentType(str, Enum):
@@ -33,21 +33,22 @@ class ErrorResponse(BaseModel):
     data: Optional[Dict[str, Any]] = None
 
 class ChatRequest(BaseModel):
-    message: str = Field(..., min_length=1, max_length=5000, description="User message")
+    # Whitespace is stripped before the length checks, so blank messages fail min_length
+    model_config = ConfigDict(str_strip_whitespace=True, extra='ignore')
     
-    @validator('message')
-    def message_not_empty(cls, v):
-        if not v or not v.strip():
-            raise ValueError('Message cannot be empty or whitespace only')
-        return v.strip()
+    user_id: str = Field(..., description="User identifier")
+    message: str = Field(..., min_length=1, max_length=5000, description="User message")
+    jwt_token: Optional[str] = Field(None, description="JWT token if not sent in the Authorization header")
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid', ser_json_inf_nan='null')
+    
     response: str
     success: bool = True
-    intent: Optional[str] = None
+    intent: Optional[IntentType] = None
     action_taken: Optional[str] = None
     data: Optional[Dict[str, Any]] = None
-    suggestions: Optional[List[str]] = None  # Quick reply suggestions
+    suggestions: Optional[Tuple[str, ...]] = None  # Quick reply suggestions
     requires_action: Optional[bool] = False  # Whether user needs to take action
     validation_errors: Optional[List[ValidationError]] = None
     message: Optional[str] = None  # Additional message for status/errors
@@ -1,27 +1,335 @@
 import os
+import re
+import asyncio
+import hashlib
+import json
+import logging
+import httpx
+from cachetools import TTLCache
+from datetime import datetime, timezone
 import google.generativeai as genai
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from models import ChatResponse, IntentType
 from conversation_manager import ConversationManager
-from symptom_triage import SymptomTriageService
+from symptom_triage import SymptomTriageService, TRIAGE_SYSTEM_INSTRUCTION, TRIAGE_GENERATION_CONFIG
 from appointment_manager import AppointmentManager, BookingState
+from keyword_matcher import KeywordMatcher
 
-# Configure Gemini
+logger = logging.getLogger(__name__)
+
+# Configure Gemini once for the whole process; every model below shares the library's client
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_MODEL = 'gemini-1.5-flash'
 
 # Backend Base URL (Spring Boot)
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8080")
 
+# Static instructions are sent as system instructions so each call only carries context + message
+INTENT_SYSTEM_INSTRUCTION = """Classify the user's intent into ONE of these categories:
+- GREETING: Greetings like hello, hi, good morning
+- SYMPTOM_CHECK: Describing symptoms or health issues
+- SEARCH_DOCTOR: Looking for doctors, asking about specialists
+- CHECK_AVAILABILITY: Asking about doctor availability or open slots
+- BOOK_APPOINTMENT: Wanting to book/schedule an appointment
+- CANCEL_APPOINTMENT: Want to cancel an appointment
+- RESCHEDULE_APPOINTMENT: Want to change appointment time
+- VIEW_APPOINTMENTS: Want to see their appointments
+- CANCEL_POLICY: Asking about cancellation or refund policy
+- INSURANCE_QUERY: Questions about insurance
+- FAREWELL: Goodbye, bye, thanks and ending conversation
+- PATIENT_QUERY: General questions about clinic, services, etc.
+
+You will receive one or more numbered messages, each a JSON-encoded string classified independently.
+A message may come with its recent conversation context (also JSON-encoded); use it to resolve short follow-ups.
+Respond with one entry per message: its number as index and its category as intent."""
+
+GENERAL_SYSTEM_INSTRUCTION = """You are a helpful medical clinic AI assistant. Answer the user's query politely and professionally.
+
+IMPORTANT Rules:
+- Do NOT give medical advice or diagnosis
+- If asked about medical conditions, suggest seeing a doctor
+- Keep responses concise (2-3 sentences)
+- Always be helpful and empathetic
+
+Respond naturally and helpfully."""
+
+SUMMARY_SYSTEM_INSTRUCTION = """You maintain a short working memory of a conversation between a patient and a medical appointment assistant.
+
+Merge the current summary (if any) with the new messages into an updated summary of at most 3 sentences.
+Keep only what is needed to continue the conversation: symptoms mentioned, doctors or specialties discussed, and booking details (doctor, date, time).
+
+Respond with the summary only."""
+
+# Replies that don't depend on the message
+_GREETING_TEXT = (
+    "Hello! 👋 I'm your AI medical appointment assistant. "
+    "I can help you with:\n"
+    "• Finding and booking doctors\n"
+    "• Checking doctor availability\n"
+    "• Analyzing symptoms\n"
+    "• Viewing your appointments\n\n"
+    "How can I assist you today?"
+)
+
+_CANCEL_POLICY_TEXT = (
+    "**Cancellation Policy:**\n\n"
+    "• You can cancel your appointment up to 24 hours before the scheduled time for a full refund.\n"
+    "• Cancellations made within 24 hours may be subject to a cancellation fee.\n"
+    "• No-shows will be charged the full consultation fee.\n"
+    "• Rescheduling is free if done at least 6 hours before the appointment.\n\n"
+    "Would you like to cancel or reschedule an existing appointment?"
+)
+
+# Would make API call to get appointments
+_VIEW_APPOINTMENTS_TEXT = (
+    "To view your appointments, please go to the 'My Appointments' section in your account. "
+    "You can also ask me to help you book, cancel, or reschedule appointments."
+)
+
+_VIEW_APPOINTMENTS_LOGIN_TEXT = "Please log in to view your appointments."
+
+_FAREWELL_TEXT = (
+    "Thank you for using our service! Take care and feel better soon. 👋\n\n"
+    "If you need any assistance in the future, I'm always here to help!"
+)
+
+# Quick reply suggestions (at most 4), shared across requests
+_GREETING_SUGG = ("Find a doctor", "Book appointment", "Check symptoms", "View my appointments")
+_SYMPTOM_SUGG = ("Book appointment", "Find specialist", "Emergency help")
+_GENERAL_SUGG = ("Book appointment", "Find doctor", "Check symptoms")
+_SEARCH_RETRY_SUGG = ("Try again", "Browse specialties")
+_LOGIN_SUGG = ("Login", "Create account")
+_SPECIALTY_SUGG = ("Cardiologist", "Dermatologist", "Dentist")
+_DATE_SUGG = ("Tomorrow", "Day after tomorrow", "Next week")
+_DATE_RETRY_SUGG = ("Tomorrow", "Try again")
+_CONFIRM_SUGG = ("Confirm", "Cancel")
+_BOOKED_SUGG = ("View appointments", "Book another")
+
+# Prompts carry the working summary plus every message since it was last refreshed
+# (at least MIN_RECENT_MESSAGES); older messages are folded into the summary every
+# SUMMARY_INTERVAL messages
+MIN_RECENT_MESSAGES = 5
+SUMMARY_INTERVAL = 10
+
+_VALID_INTENTS = frozenset(e.value for e in IntentType)
+
+# Batched classification comes back as a JSON array of {index, intent}, one per numbered message
+INTENT_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {
+                "index": {"type": "INTEGER"},
+                "intent": {"type": "STRING", "enum": sorted(_VALID_INTENTS - {IntentType.UNKNOWN.value})},
+            },
+            "required": ["index", "intent"],
+        },
+    },
+}
+
+# Single-word greetings and farewells are matched as whole words, so "hi" in "which" doesn't count
+_GREETING_WORDS = frozenset({"hello", "hi", "hey"})
+_FAREWELL_WORDS = frozenset({"bye", "goodbye"})
+
+# Rule-based intent keywords and phrases, in priority order (compiled once into a single scan).
+# These stay substring matches: stems like "ache" and "book" must hit "headache" and "booking"
+_INTENT_KEYWORDS = KeywordMatcher({
+    IntentType.GREETING.value: ["good morning", "good evening"],
+    IntentType.SYMPTOM_CHECK.value: ["pain", "fever", "sick", "symptom", "ache", "hurt", "cough", "cold"],
+    IntentType.BOOK_APPOINTMENT.value: ["book", "appointment", "schedule", "reserve"],
+    IntentType.SEARCH_DOCTOR.value: ["doctor", "specialist", "find", "search", "cardiologist", "dermatologist"],
+    IntentType.CANCEL_POLICY.value: ["cancel", "refund", "policy"],
+    IntentType.FAREWELL.value: ["see you"],
+})
+
+# Unambiguous phrases that settle the intent without asking Gemini, in priority order
+_STRONG_INTENT_PHRASES = KeywordMatcher({
+    IntentType.SYMPTOM_CHECK.value: [
+        "chest pain", "heart attack", "difficulty breathing", "can't breathe", "severe bleeding"
+    ],
+    IntentType.BOOK_APPOINTMENT.value: [
+        "book an appointment", "book appointment", "schedule an appointment", "make an appointment"
+    ],
+    IntentType.CANCEL_POLICY.value: ["cancellation policy", "refund policy", "cancel policy"],
+})
+
+# Messages that are nothing but a greeting or farewell
+_STANDALONE_INTENTS = {
+    **dict.fromkeys(
+        ["hi", "hello", "hey", "hi there", "hello there", "good morning", "good afternoon", "good evening"],
+        IntentType.GREETING.value
+    ),
+    **dict.fromkeys(["bye", "goodbye", "bye bye", "see you", "thanks, bye", "thank you, bye"], IntentType.FAREWELL.value),
+}
+
+# Common specialty keywords, in priority order
+_SPECIALTY_KEYWORDS = KeywordMatcher({
+    specialty: [specialty] for specialty in [
+        "cardiologist", "dermatologist", "orthopedic", "pediatrician",
+        "dentist", "gynecologist", "neurologist", "psychiatrist",
+        "ophthalmologist", "ent", "gastroenterologist"
+    ]
+})
+
+_QUOTED_RE = re.compile(r'"([^"]+)"')
+_FOR_RE = re.compile(r'for\s+(\w+)')
+
+class IntentBatcher:
+    """
+    Coalesces concurrent intent classifications into a single Gemini call
+    
+    Requests arriving within max_wait seconds (up to max_batch of them) are
+    sent together as one numbered prompt; each caller awaits its own entry of
+    the response. Batches carry only the JSON-encoded messages: a user's
+    conversation context is never sent alongside other users' messages.
+    """
+    
+    def __init__(self, model, max_batch: int = 8, max_wait: float = 0.02, max_concurrency: int = 4):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+    
+    async def submit(self, message: str) -> str:
+        """Queue a message (without context) for batched classification and wait for its category"""
+        # A restarted worker picks up whatever is still queued
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._collect())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, future))
+        return await future
+    
+    async def classify_with_context(self, message: str, context: str) -> str:
+        """Classify one message with its conversation context in a call of its own"""
+        response = await self.model.generate_content_async(self._build_prompt([(message, context)]))
+        return self._parse_intents(response.text, 1)[0]
+    
+    @staticmethod
+    def _build_prompt(items: List[Tuple[str, str]]) -> str:
+        """Numbered prompt of (message, context) items; JSON encoding keeps user text from forging entries"""
+        blocks = []
+        for i, (message, context) in enumerate(items, 1):
+            lines = [f"[{i}] Message: {json.dumps(message)}"]
+            if context:
+                lines.append(f"Context: {json.dumps(context)}")
+            blocks.append("\n".join(lines))
+        return f"Classify each of the following {len(items)} message(s).\n\n" + "\n\n".join(blocks)
+    
+    @staticmethod
+    def _parse_intents(response_text: str, count: int) -> List[str]:
+        """Intents in message order, or ValueError unless there is exactly one per message"""
+        entries = json.loads(response_text)
+        intents = {entry["index"]: entry["intent"] for entry in entries}
+        
+        # A skipped, merged or renumbered item would hand users each other's intents
+        if len(entries) != count or intents.keys() != set(range(1, count + 1)):
+            raise ValueError(f"Expected {count} indexed intents, got {response_text!r}")
+        return [intents[i] for i in range(1, count + 1)]
+    
+    async def _collect(self) -> None:
+        """Drain the queue into batches and dispatch them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                
+                # Keep collecting the next batch while this one is in flight
+                await self._semaphore.acquire()
+            except BaseException as e:
+                # Worker cancelled mid-batch: don't leave these callers waiting
+                self._fail_batch(batch, e)
+                raise
+            task = asyncio.create_task(self._classify_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+    
+    @staticmethod
+    def _fail_batch(batch: List[Tuple[str, asyncio.Future]], error: BaseException) -> None:
+        """Resolve every pending future in the batch with an error, so callers fall back to rules"""
+        if isinstance(error, asyncio.CancelledError):
+            error = RuntimeError("Intent classification batch was cancelled")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _classify_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Classify a batch in one call and resolve each waiting future"""
+        try:
+            prompt = self._build_prompt([(message, "") for message, _ in batch])
+            response = await self.model.generate_content_async(prompt)
+            
+            for intent, (_, future) in zip(self._parse_intents(response.text, len(batch)), batch):
+                if not future.done():
+                    future.set_result(intent)
+        except BaseException as e:
+            self._fail_batch(batch, e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self._semaphore.release()
+
 class AIAgentService:
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-1.5-flash') if GEMINI_API_KEY else None
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        if GEMINI_API_KEY:
+            self.intent_model = genai.GenerativeModel(
+                GEMINI_MODEL, system_instruction=INTENT_SYSTEM_INSTRUCTION, generation_config=INTENT_GENERATION_CONFIG
+            )
+            self.general_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=GENERAL_SYSTEM_INSTRUCTION)
+            self.summary_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SUMMARY_SYSTEM_INSTRUCTION)
+            self.triage_model = genai.GenerativeModel(
+                GEMINI_MODEL, system_instruction=TRIAGE_SYSTEM_INSTRUCTION, generation_config=TRIAGE_GENERATION_CONFIG
+            )
+            self.intent_batcher = IntentBatcher(self.intent_model)
+        else:
+            self.intent_model = None
+            self.general_model = None
+            self.summary_model = None
+            self.triage_model = None
+            self.intent_batcher = None
+        self._background_tasks: set = set()
+        # Gemini results for repeated (message, context) pairs
+        self._intent_cache: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+        self._general_response_cache: TTLCache = TTLCache(maxsize=4096, ttl=3600)
         self.conversation_manager = ConversationManager()
-        self.symptom_triage = SymptomTriageService()
-        self.appointment_manager = AppointmentManager(BACKEND_URL)
+        self.symptom_triage = SymptomTriageService(model=self.triage_model)
+        self.appointment_manager = AppointmentManager(BACKEND_URL, client=http_client)
+        
+        # Fixed replies are built once and shared; nothing mutates a returned ChatResponse
+        self._static_responses: Dict[str, ChatResponse] = {
+            IntentType.GREETING.value: ChatResponse(
+                response=_GREETING_TEXT,
+                intent=IntentType.GREETING,
+                suggestions=_GREETING_SUGG
+            ),
+            IntentType.CANCEL_POLICY.value: ChatResponse(response=_CANCEL_POLICY_TEXT, intent=IntentType.CANCEL_POLICY),
+            IntentType.FAREWELL.value: ChatResponse(response=_FAREWELL_TEXT, intent=IntentType.FAREWELL),
+        }
+        # Keyed by whether the user is logged in
+        self._view_appointments_responses: Dict[bool, ChatResponse] = {
+            True: ChatResponse(response=_VIEW_APPOINTMENTS_TEXT, intent=IntentType.VIEW_APPOINTMENTS),
+            False: ChatResponse(response=_VIEW_APPOINTMENTS_LOGIN_TEXT, intent=IntentType.VIEW_APPOINTMENTS),
+        }
     
-    async def process_message(self, user_id: str, message: str, jwt_token: Optional[str] = None) -> ChatResponse:
+    async def process_message(self, user_id: str, message: str, jwt_token: Optional[str] = None, *, now_iso: Optional[str] = None) -> ChatResponse:
         """
         Main entry point for processing user messages
         
@@ -29,191 +337,251 @@ class AIAgentService:
             user_id: User identifier
             message: User's message
             jwt_token: JWT token for authenticated requests
+            now_iso: Request timestamp (UTC ISO-8601), computed once per request
         
         Returns:
             ChatResponse with AI response and metadata
         """
-        # Get or create session
-        session = self.conversation_manager.get_session(user_id)
+        now_iso = now_iso or datetime.now(timezone.utc).isoformat()
         
         # Add user message to history
-        self.conversation_manager.add_message(user_id, "user", message)
+        self.conversation_manager.add_message(user_id, "user", message, now_iso=now_iso)
+        
+        # Get or create session, plus recent conversation context, in one round-trip.
+        # Enough is loaded for any unsummarized stretch (plus the message just added)
+        session, history = self.conversation_manager.load_context(
+            user_id, limit=max(SUMMARY_INTERVAL, MIN_RECENT_MESSAGES) + 1, now_iso=now_iso
+        )
+        # The newest entry is the message just added, which prompts already carry as the current message
+        if history and history[-1]["role"] == "user" and history[-1]["content"] == message:
+            history = history[:-1]
+        conversation_history = self._working_context(session, history)
         
-        # Get conversation context
-        conversation_history = self.conversation_manager.get_context_string(user_id, limit=5)
+        message_lower = message.lower()
+        
+        # Likely doctor searches hit the backend while the intent is still being classified
+        prefetch = self._speculative_search(message_lower)
         
         # Classify intent
-        intent = self._classify_intent(message, conversation_history)
-        print(f"[AI Agent] Detected Intent: {intent} for user: {user_id}")
+        intent = await self._classify_intent(message, message_lower, conversation_history)
+        logger.debug("Detected intent %s for user %s", intent, user_id)
+        
+        # Fixed replies skip the handlers entirely
+        static_response = self._static_response(intent, jwt_token)
+        if static_response is not None:
+            if prefetch:
+                prefetch.cancel()
+            if intent == IntentType.FAREWELL.value:
+                self.conversation_manager.end_session(user_id)
+            self._record_reply(
+                user_id, static_response.response, now_iso, count_turn=intent != IntentType.FAREWELL.value
+            )
+            return static_response
         
         # Handle based on intent
         response_text = ""
         action_data = None
-        suggestions = []
+        suggestions: Tuple[str, ...] = ()
         
         try:
-            if intent == IntentType.GREETING.value:
-                response_text = self._handle_greeting(user_id)
-                suggestions = [
-                    "Find a doctor",
-                    "Book appointment",
-                    "Check symptoms",
-                    "View my appointments"
-                ]
-            
-            elif intent == IntentType.SYMPTOM_CHECK.value:
-                response_text, action_data = self._handle_symptom_check(message)
-                suggestions = ["Book appointment", "Find specialist", "Emergency help"]
+            if intent == IntentType.SYMPTOM_CHECK.value:
+                response_text, action_data = await self._handle_symptom_check(message)
+                suggestions = _SYMPTOM_SUGG
             
             elif intent == IntentType.SEARCH_DOCTOR.value or intent == IntentType.CHECK_AVAILABILITY.value:
-                response_text, action_data, suggestions = self._handle_doctor_search(message, session)
+                response_text, action_data, suggestions = await self._handle_doctor_search(
+                    message, message_lower, session, prefetched=prefetch
+                )
             
             elif intent == IntentType.BOOK_APPOINTMENT.value:
                 response_text, action_data, suggestions = await self._handle_booking_flow(
-                    user_id, message, session, jwt_token
+                    user_id, message, message_lower, session, jwt_token
                 )
             
-            elif intent == IntentType.CANCEL_POLICY.value:
-                response_text = self._handle_cancel_policy()
-            
-            elif intent == IntentType.VIEW_APPOINTMENTS.value:
-                response_text = self._handle_view_appointments(user_id, jwt_token)
-                
-            elif intent == IntentType.FAREWELL.value:
-                response_text = self._handle_farewell(user_id)
-                self.conversation_manager.end_session(user_id)
-            
             else:
                 # General query
-                response_text = self._generate_general_response(message, conversation_history)
-                suggestions = ["Book appointment", "Find doctor", "Check symptoms"]
+                response_text = await self._generate_general_response(message, message_lower, conversation_history)
+                suggestions = _GENERAL_SUGG
         
-        except Exception as e:
-            print(f"[AI Agent] Error processing message: {e}")
+        except Exception:
+            logger.exception("Error processing message for user %s", user_id)
             response_text = "I apologize, but I'm having trouble processing your request. Please try again or rephrase your question."
+        finally:
+            # Wrong guess - drop the speculative search
+            if prefetch and not prefetch.done():
+                prefetch.cancel()
         
         # Add assistant response to history
-        self.conversation_manager.add_message(user_id, "assistant", response_text)
+        self._record_reply(user_id, response_text, now_iso)
         
         return ChatResponse(
             response=response_text,
             intent=intent,
             data=action_data,
-            suggestions=suggestions[:4] if suggestions else None  # Limit to 4 suggestions
+            suggestions=suggestions or None
+        )
+    
+    def _working_context(self, session: Dict, history: list) -> str:
+        """Working summary of earlier turns plus every message it doesn't cover yet"""
+        context = session.get("context", {})
+        window = max(context.get("messages_since_summary", 0), MIN_RECENT_MESSAGES)
+        recent = self.conversation_manager.format_context(history[-window:])
+        summary = context.get("working_summary")
+        if summary:
+            return f"Summary of earlier conversation: {summary}\n{recent}"
+        return recent
+    
+    def record_cached_turn(self, user_id: str, message: str, response_text: str, *, now_iso: Optional[str] = None) -> None:
+        """Record a turn answered from the response cache, so history and the summary stay complete"""
+        self.conversation_manager.add_message(user_id, "user", message, now_iso=now_iso)
+        self._record_reply(user_id, response_text, now_iso)
+    
+    def _record_reply(self, user_id: str, response_text: str, now_iso: Optional[str], count_turn: bool = True) -> None:
+        """Store the assistant reply and count the turn toward the next working summary"""
+        if not (count_turn and self.summary_model):
+            self.conversation_manager.add_message(user_id, "assistant", response_text, now_iso=now_iso)
+            return
+        
+        # The counter rides along with the history write, so tracking costs no extra round-trip
+        pending = self.conversation_manager.add_message(
+            user_id, "assistant", response_text, now_iso=now_iso,
+            count_field="messages_since_summary", count_by=2  # user + assistant
         )
+        
+        if pending >= SUMMARY_INTERVAL:
+            self.conversation_manager.update_session_context(user_id, {"messages_since_summary": 0})
+            task = asyncio.create_task(self._refresh_summary(user_id, pending))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+    
+    async def _refresh_summary(self, user_id: str, new_messages: int) -> None:
+        """Fold the latest messages into the user's working summary"""
+        session, history = self.conversation_manager.load_context(user_id, limit=new_messages)
+        previous_summary = session.get("context", {}).get("working_summary", "")
+        
+        prompt = (
+            (f"Current summary: {previous_summary}\n\n" if previous_summary else "")
+            + f"New messages:\n{self.conversation_manager.format_context(history)}"
+        )
+        
+        try:
+            response = await self.summary_model.generate_content_async(prompt)
+            self.conversation_manager.update_session_context(
+                user_id, {"working_summary": response.text.strip()}
+            )
+        except Exception:
+            logger.exception("Summary refresh failed for user %s", user_id)
     
-    def _classify_intent(self, message: str, context: str = "") -> str:
+    async def _classify_intent(self, message: str, message_lower: str, context: str = "") -> str:
         """Classify user intent using AI"""
-        if not self.model:
-            return self._fallback_intent_classification(message)
+        # Clear-cut messages don't need a Gemini round-trip
+        fast = self._fast_rule_intent(message_lower)
+        if fast:
+            return fast
+        
+        if not self.intent_batcher:
+            return self._fallback_intent_classification(message_lower)
+        
+        cache_key = self._llm_cache_key(message_lower, context)
+        cached = self._intent_cache.get(cache_key)
+        if cached:
+            return cached
         
-        prompt = f"""Classify the user's intent into ONE of these categories:
-- GREETING: Greetings like hello, hi, good morning
-- SYMPTOM_CHECK: Describing symptoms or health issues
-- SEARCH_DOCTOR: Looking for doctors, asking about specialists
-- CHECK_AVAILABILITY: Asking about doctor availability or open slots
-- BOOK_APPOINTMENT: Wanting to book/schedule an appointment
-- CANCEL_APPOINTMENT: Want to cancel an appointment
-- RESCHEDULE_APPOINTMENT: Want to change appointment time
-- VIEW_APPOINTMENTS: Want to see their appointments
-- CANCEL_POLICY: Asking about cancellation or refund policy
-- INSURANCE_QUERY: Questions about insurance
-- FAREWELL: Goodbye, bye, thanks and ending conversation
-- PATIENT_QUERY: General questions about clinic, services, etc.
-
-{f"Recent conversation context: {context}" if context else ""}
-
-Current message: "{message}"
-
-Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
-
         try:
-            response = self.model.generate_content(prompt)
-            intent = response.text.strip()
+            if context:
+                # Context is private to this user, so it never shares a call with other users
+                intent = await self.intent_batcher.classify_with_context(message, context)
+            else:
+                # Batched with other users' concurrent requests into one Gemini call
+                intent = await self.intent_batcher.submit(message)
             
             # Validate intent
-            valid_intents = [e.value for e in IntentType]
-            if intent in valid_intents:
+            if intent in _VALID_INTENTS:
+                self._intent_cache[cache_key] = intent
                 return intent
             
             # Fallback
-            return self._fallback_intent_classification(message)
-        except Exception as e:
-            print(f"[AI Agent] Intent classification error: {e}")
-            return self._fallback_intent_classification(message)
+            return self._fallback_intent_classification(message_lower)
+        except Exception:
+            logger.exception("Intent classification failed, using rules")
+            return self._fallback_intent_classification(message_lower)
     
-    def _fallback_intent_classification(self, message: str) -> str:
-        """Rule-based intent classification fallback"""
-        message_lower = message.lower()
-        
-        # Greeting
-        if any(word in message_lower for word in ["hello", "hi", "hey", "good morning", "good evening"]):
+    def _llm_cache_key(self, message_lower: str, context: str) -> Tuple[str, bytes]:
+        """Cache key for a Gemini result: normalized message plus a digest of the context"""
+        return message_lower.strip(), hashlib.blake2b(context.encode(), digest_size=16).digest()
+    
+    def _fast_rule_intent(self, message_lower: str) -> Optional[str]:
+        """High-confidence rule-based intent, or None if the message needs the model"""
+        standalone = _STANDALONE_INTENTS.get(message_lower.strip(" .!?"))
+        if standalone:
+            return standalone
+        return _STRONG_INTENT_PHRASES.first(message_lower)
+    
+    def _speculative_search(self, message_lower: str) -> Optional[asyncio.Task]:
+        """Start a doctor search early if the rules say this is a search for a known specialty"""
+        if self._fallback_intent_classification(message_lower) != IntentType.SEARCH_DOCTOR.value:
+            return None
+        
+        # Same keyword _extract_search_keyword picks first, so the prefetched result matches
+        specialty = _SPECIALTY_KEYWORDS.first(message_lower)
+        if not specialty:
+            return None
+        return asyncio.create_task(self.appointment_manager.search_doctors(specialty))
+    
+    def _fallback_intent_classification(self, message_lower: str) -> str:
+        """Rule-based intent classification fallback (expects lowercased text)"""
+        # Greeting > symptom > booking > doctor search > cancel policy > farewell
+        tokens = frozenset(word.strip(".,!?") for word in message_lower.split())
+        if tokens & _GREETING_WORDS:
             return IntentType.GREETING.value
         
-        # Symptom check
-        if any(word in message_lower for word in ["pain", "fever", "sick", "symptom", "ache", "hurt", "cough", "cold"]):
-            return IntentType.SYMPTOM_CHECK.value
+        intent = _INTENT_KEYWORDS.first(message_lower)
+        if intent:
+            return intent
         
-        # Booking
-        if any(word in message_lower for word in ["book", "appointment", "schedule", "reserve"]):
-            return IntentType.BOOK_APPOINTMENT.value
-        
-        # Doctor search
-        if any(word in message_lower for word in ["doctor", "specialist", "find", "search", "cardiologist", "dermatologist"]):
-            return IntentType.SEARCH_DOCTOR.value
-        
-        # Cancel policy
-        if any(word in message_lower for word in ["cancel", "refund", "policy"]):
-            return IntentType.CANCEL_POLICY.value
-        
-        # Farewell
-        if any(word in message_lower for word in ["bye", "goodbye", "see you", "thanks", "thank you"]) and \
-           any(word in message_lower for word in ["bye", "goodbye", "see you"]):
+        if tokens & _FAREWELL_WORDS:
             return IntentType.FAREWELL.value
-        
         return IntentType.PATIENT_QUERY.value
     
-    def _handle_greeting(self, user_id: str) -> str:
-        """Handle greeting messages"""
-        return (
-            "Hello! 👋 I'm your AI medical appointment assistant. "
-            "I can help you with:\n"
-            "• Finding and booking doctors\n"
-            "• Checking doctor availability\n"
-            "• Analyzing symptoms\n"
-            "• Viewing your appointments\n\n"
-            "How can I assist you today?"
-        )
+    def _static_response(self, intent: str, jwt_token: Optional[str]) -> Optional[ChatResponse]:
+        """Prebuilt response for intents with a fixed reply, or None"""
+        if intent == IntentType.VIEW_APPOINTMENTS.value:
+            return self._view_appointments_responses[bool(jwt_token)]
+        return self._static_responses.get(intent)
     
-    def _handle_symptom_check(self, message: str) -> Tuple[str, Optional[Dict]]:
+    async def _handle_symptom_check(self, message: str) -> Tuple[str, Optional[Dict]]:
         """Handle symptom analysis"""
-        result = self.symptom_triage.analyze_symptoms(message)
-        
-        response = f"**Symptom Analysis:**\n\n"
-        response += f"🔍 Urgency: {result['urgency']}\n"
-        response += f"👨‍⚕️ Recommended Specialty: {result['recommended_specialty']}\n"
-        response += f"💡 Advice: {result['advice']}\n\n"
-        response += f"_{result['disclaimer']}_\n\n"
-        
-        if result['urgency'] != 'EMERGENCY':
-            response += "Would you like me to help you find a specialist or book an appointment?"
+        result = await self.symptom_triage.analyze_symptoms(message)
+        
+        parts = [
+            "**Symptom Analysis:**\n",
+            f"🔍 Urgency: {result['urgency']}",
+            f"👨‍⚕️ Recommended Specialty: {result['recommended_specialty']}",
+            f"💡 Advice: {result['advice']}\n",
+            f"_{result['disclaimer']}_\n",
+            "Would you like me to help you find a specialist or book an appointment?"
+            if result['urgency'] != 'EMERGENCY' else ""
+        ]
         
-        return response, result
+        return "\n".join(parts), result
     
-    def _handle_doctor_search(self, message: str, session: Dict) -> Tuple[str, Optional[Dict], list]:
-        """Handle doctor search queries"""
+    async def _handle_doctor_search(self, message: str, message_lower: str, session: Dict, prefetched: Optional[asyncio.Task] = None) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
+        """Handle doctor search queries, reusing a speculative search for the same keyword if given"""
         # Extract search keyword from message
-        keyword = self._extract_search_keyword(message)
+        keyword = self._extract_search_keyword(message, message_lower)
         
         if not keyword:
             return (
                 "I'd be happy to help you find a doctor. Could you please tell me:\n"
                 "• What specialty are you looking for? (e.g., Cardiologist, Dermatologist)\n"
                 "• Or which city/location?"
-            ), None, []
+            ), None, ()
         
         # Search doctors
-        search_result = self.appointment_manager.search_doctors(keyword)
+        if prefetched is not None:
+            search_result = await prefetched
+        else:
+            search_result = await self.appointment_manager.search_doctors(keyword)
         
         # Handle errors
         if not search_result.get("success"):
@@ -221,7 +589,7 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
             
             # If no results found, suggest specialties
             if search_result.get("error_code") == "NOT_FOUND":
-                specialists = self.appointment_manager.get_specialists()
+                specialists = await self.appointment_manager.get_specialists()
                 specialist_names = [s.get('specialist', '') for s in specialists[:10]]
                 
                 return (
@@ -229,33 +597,35 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
                     f"Here are some available specialties:\n" +
                     "\n".join(f"• {s}" for s in specialist_names) +
                     "\n\nWhich specialty would you like?"
-                ), {"specialists": specialists}, specialist_names[:4]
+                ), {"specialists": specialists}, tuple(specialist_names[:4])
             
-            return error_message, None, ["Try again", "Browse specialties"]
+            return error_message, None, _SEARCH_RETRY_SUGG
         
         doctors = search_result.get("data", [])
+        # The list may be trimmed to the search limit; report every match
+        total = search_result.get("total", len(doctors))
         
         if not doctors:
             return (
                 "I couldn't find any doctors at the moment. Please try again later."
-            ), None, []
-        
-        # Format doctor list
-        response = f"I found {len(doctors)} doctor(s) for '{keyword}':\n\n"
-        
-        for i, doc in enumerate(doctors[:5], 1):
-            response += (
-                f"{i}. Dr. {doc.get('firstName', '')} {doc.get('lastName', '')}\n"
-                f"   Specialty: {doc.get('specialist', 'N/A')}\n"
-                f"   Experience: {doc.get('experience', 'N/A')} years\n"
-                f"   Fee: ₹{doc.get('consultationFee', 'N/A')}\n"
-                f"   Location: {doc.get('clinicName', 'N/A')}, {doc.get('city', 'N/A')}\n\n"
-            )
+            ), None, ()
+        
+        # Format doctor list, joined once at the end
+        parts = [f"I found {total} doctor(s) for '{keyword}':\n"]
+        parts.extend(
+            f"{i}. Dr. {doc.get('firstName', '')} {doc.get('lastName', '')}\n"
+            f"   Specialty: {doc.get('specialist', 'N/A')}\n"
+            f"   Experience: {doc.get('experience', 'N/A')} years\n"
+            f"   Fee: ₹{doc.get('consultationFee', 'N/A')}\n"
+            f"   Location: {doc.get('clinicName', 'N/A')}, {doc.get('city', 'N/A')}\n"
+            for i, doc in enumerate(doctors[:5], 1)
+        )
         
-        if len(doctors) > 5:
-            response += f"...and {len(doctors) - 5} more.\n\n"
+        if total > 5:
+            parts.append(f"...and {total - 5} more.\n")
         
-        response += "Would you like to book an appointment with any of these doctors?"
+        parts.append("Would you like to book an appointment with any of these doctors?")
+        response = "\n".join(parts)
         
         # Update session context
         self.conversation_manager.update_session_context(
@@ -263,32 +633,23 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
             {"available_doctors": [d['doctorId'] for d in doctors[:5]]}
         )
         
-        suggestions = [f"Book with Dr. {d.get('lastName', '')}" for d in doctors[:3]]
+        suggestions = tuple(f"Book with Dr. {d.get('lastName', '')}" for d in doctors[:3])
         
         return response, {"doctors": doctors[:5]}, suggestions
     
-    def _extract_search_keyword(self, message: str) -> str:
+    def _extract_search_keyword(self, message: str, message_lower: str) -> str:
         """Extract search keyword from message"""
-        message_lower = message.lower()
         
-        # Common specialty keywords
-        specialties = [
-            "cardiologist", "dermatologist", "orthopedic", "pediatrician",
-            "dentist", "gynecologist", "neurologist", "psychiatrist",
-            "ophthalmologist", "ent", "gastroenterologist"
-        ]
-        
-        for specialty in specialties:
-            if specialty in message_lower:
-                return specialty
+        specialty = _SPECIALTY_KEYWORDS.first(message_lower)
+        if specialty:
+            return specialty
         
         #Extract quoted text or after "for"
-        import re
-        quoted = re.search(r'"([^"]+)"', message)
+        quoted = _QUOTED_RE.search(message)
         if quoted:
             return quoted.group(1)
         
-        for_match = re.search(r'for\s+(\w+)', message_lower)
+        for_match = _FOR_RE.search(message_lower)
         if for_match:
             return for_match.group(1)
         
@@ -301,66 +662,78 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
         
         return ""
     
-    async def _handle_booking_flow(self, user_id: str, message: str, session: Dict, jwt_token: Optional[str]) -> Tuple[str, Optional[Dict], list]:
+    async def _handle_booking_flow(self, user_id: str, message: str, message_lower: str, session: Dict, jwt_token: Optional[str]) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
         """Handle multi-turn appointment booking flow"""
         
         if not jwt_token:
             return (
                 "To book an appointment, you need to be logged in. "
                 "Please log in to your account and try again."
-            ), None, ["Login", "Create account"]
+            ), None, _LOGIN_SUGG
         
         # Get current booking state from session
         booking_state = session.get("context", {}).get("booking_state", BookingState.INITIAL.value)
         
         # Extract booking information from message
-        booking_info = self.appointment_manager.extract_booking_info(message, session.get("context", {}))
+        booking_info = self.appointment_manager.extract_booking_info(message_lower, session.get("context", {}))
         
         # Update context with extracted info
         if booking_info:
-            self.conversation_manager.update_session_context(user_id, booking_info)
-            session = self.conversation_manager.get_session(user_id)
+            session = self.conversation_manager.update_session(user_id, session, booking_info)
         
         context = session.get("context", {})
         
         # State machine for booking flow
         if not context.get("doctor_id"):
             # Need to select doctor first
-            return self._booking_step_select_doctor(message, context)
+            return await self._booking_step_select_doctor(message, message_lower, context)
         
         elif not context.get("date"):
             # Need to select date
-            return self._booking_step_select_date(message, context)
+            return await self._booking_step_select_date(user_id, message_lower, context)
         
         elif not context.get("time"):
             # Need to select time
-            return self._booking_step_select_time(message, context)
+            return self._booking_step_select_time(message_lower, context)
         
         else:
             # All info collected, confirm
             return self._booking_step_confirm(user_id, context, jwt_token)
     
-    def _booking_step_select_doctor(self, message: str, context: Dict) -> Tuple[str, Optional[Dict], list]:
+    async def _booking_step_select_doctor(self, message: str, message_lower: str, context: Dict) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
         """Booking step 1: Select doctor"""
-        keyword = self._extract_search_keyword(message)
+        keyword = self._extract_search_keyword(message, message_lower)
         
         if keyword:
-            return self._handle_doctor_search(message, {"user_id": context.get("user_id", ""), "context": context})
+            return await self._handle_doctor_search(
+                message, message_lower, {"user_id": context.get("user_id", ""), "context": context}
+            )
         
         return (
             "To book an appointment, I need to know which doctor you'd like to see. "
             "You can search by specialty (e.g., 'cardiologist') or doctor name."
-        ), None, ["Cardiologist", "Dermatologist", "Dentist"]
+        ), None, _SPECIALTY_SUGG
     
-    def _booking_step_select_date(self, message: str, context: Dict) -> Tuple[str, Optional[Dict], list]:
+    async def _booking_step_select_date(self, user_id: str, message_lower: str, context: Dict) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
         """Booking step 2: Select date"""
-        date = self.appointment_manager.parse_date_from_text(message)
+        date = self.appointment_manager.parse_date_from_text(message_lower, text_lower=message_lower)
         
         if date:
             # Check available slots for this date
             doctor_id = context.get("doctor_id")
             if doctor_id:
-                slots_result = self.appointment_manager.get_available_slots(doctor_id, date)
+                # Doctor details and slots are independent - fetch them concurrently
+                doctor_result, slots_result = await asyncio.gather(
+                    self.appointment_manager.get_doctor_by_id(doctor_id),
+                    self.appointment_manager.get_available_slots(doctor_id, date)
+                )
+                
+                if doctor_result.get("success") and not context.get("doctor_name"):
+                    doctor = doctor_result.get("data") or {}
+                    context["doctor_name"] = self.appointment_manager.format_doctor_info(doctor)
+                    self.conversation_manager.update_session_context(
+                        user_id, {"doctor_name": context["doctor_name"]}
+                    )
                 
                 # Handle errors
                 if not slots_result.get("success"):
@@ -370,16 +743,16 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
                     if error_code == "PAST_DATE":
                         return (
                             error_message + " Please select a future date."
-                        ), None, ["Tomorrow", "Day after tomorrow", "Next week"]
+                        ), None, _DATE_SUGG
                     elif error_code == "NO_SLOTS_FOUND":
                         return (
                             f"Sorry, no slots available on {date}. "
                             "Would you like to try another date?"
-                        ), None, ["Tomorrow", "Day after tomorrow", "Next week"]
+                        ), None, _DATE_SUGG
                     else:
                         return (
                             f"{error_message}. Would you like to try another date?"
-                        ), None, ["Tomorrow", "Try again"]
+                        ), None, _DATE_RETRY_SUGG
                 
                 slots = slots_result.get("data", [])
                 
@@ -388,21 +761,21 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
                     return (
                         f"Great! Here are available time slots for {date}:\n\n{formatted_slots}\n\n"
                         "Which time works best for you?"
-                    ), {"available_slots": slots, "date": date}, []
+                    ), {"available_slots": slots, "date": date}, ()
                 else:
                     return (
                         f"Sorry, no slots available on {date}. "
                         "Would you like to try another date?"
-                    ), None, ["Tomorrow", "Day after tomorrow", "Next week"]
+                    ), None, _DATE_SUGG
         
         return (
             "When would you like to schedule the appointment? "
             "You can say something like 'tomorrow', 'next Monday', or provide a specific date."
-        ), None, ["Tomorrow", "Day after tomorrow", "Next week"]
+        ), None, _DATE_SUGG
     
-    def _booking_step_select_time(self, message: str, context: Dict) -> Tuple[str, Optional[Dict], list]:
+    def _booking_step_select_time(self, message_lower: str, context: Dict) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
         """Booking step 3: Select time"""
-        time = self.appointment_manager.parse_time_from_text(message)
+        time = self.appointment_manager.parse_time_from_text(message_lower, text_lower=message_lower)
         
         if time:
             return (
@@ -411,14 +784,14 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
                 f"🕐 Time: {time}\n"
                 f"👨‍⚕️ Doctor: {context.get('doctor_name', 'Selected doctor')}\n\n"
                 "Please confirm to book this appointment."
-            ), {"time": time}, ["Confirm", "Cancel"]
+            ), {"time": time}, _CONFIRM_SUGG
         
         return (
             "What time would you prefer? "
             "You can say something like '3:00 PM' or '15:00'."
-        ), None, []
+        ), None, ()
     
-    def _booking_step_confirm(self, user_id: str, context: Dict, jwt_token: Optional[str]) -> Tuple[str, Optional[Dict], list]:
+    def _booking_step_confirm(self, user_id: str, context: Dict, jwt_token: Optional[str]) -> Tuple[str, Optional[Dict], Tuple[str, ...]]:
         """Booking step 4: Confirm and create appointment"""
         # This would make an actual API call to book the appointment
         # For now, return confirmation message
@@ -429,61 +802,30 @@ Respond with ONLY the category name (e.g., BOOK_APPOINTMENT)."""
             f"👨‍⚕️ Doctor: {context.get('doctor_name', 'Doctor')}\n\n"
             "You will receive a confirmation email and SMS shortly. "
             "You can view all your appointments in 'My Appointments'."
-        ), {"booking_confirmed": True}, ["View appointments", "Book another"]
-    
-    def _handle_cancel_policy(self) -> str:
-        """Handle cancellation policy query"""
-        return (
-            "**Cancellation Policy:**\n\n"
-            "• You can cancel your appointment up to 24 hours before the scheduled time for a full refund.\n"
-            "• Cancellations made within 24 hours may be subject to a cancellation fee.\n"
-            "• No-shows will be charged the full consultation fee.\n"
-            "• Rescheduling is free if done at least 6 hours before the appointment.\n\n"
-            "Would you like to cancel or reschedule an existing appointment?"
-        )
-    
-    def _handle_view_appointments(self, user_id: str, jwt_token: Optional[str]) -> str:
-        """Handle view appointments request"""
-        if not jwt_token:
-            return "Please log in to view your appointments."
-        
-        # Would make API call to get appointments
-        return (
-            "To view your appointments, please go to the 'My Appointments' section in your account. "
-            "You can also ask me to help you book, cancel, or reschedule appointments."
-        )
-    
-    def _handle_farewell(self, user_id: str) -> str:
-        """Handle farewell message"""
-        return (
-            "Thank you for using our service! Take care and feel better soon. 👋\n\n"
-            "If you need any assistance in the future, I'm always here to help!"
-        )
+        ), {"booking_confirmed": True}, _BOOKED_SUGG
     
-    def _generate_general_response(self, message: str, context: str = "") -> str:
+    async def _generate_general_response(self, message: str, message_lower: str, context: str = "") -> str:
         """Generate response for general queries using AI"""
-        if not self.model:
+        if not self.general_model:
             return "I'm here to help you with booking appointments, finding doctors, and checking symptoms. How can I assist you?"
         
-        prompt = f"""You are a helpful medical clinic AI assistant. Answer the following query politely and professionally.
-
-        IMPORTANT Rules:
-        - Do NOT give medical advice or diagnosis
-        - If asked about medical conditions, suggest seeing a doctor
-        - Keep responses concise (2-3 sentences)
-        - Always be helpful and empathetic
-
-        {f"Recent conversation: {context}" if context else ""}
-
-        User Query: "{message}"
+        cache_key = self._llm_cache_key(message_lower, context)
+        cached = self._general_response_cache.get(cache_key)
+        if cached:
+            return cached
+        
+        prompt = f"""{f"Recent conversation: {context}" if context else ""}
 
-        Respond naturally and helpfully:"""
+User Query: "{message}"
+"""
 
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            print(f"[AI Agent] General response error: {e}")
+            response = await self.general_model.generate_content_async(prompt)
+            text = response.text.strip()
+            self._general_response_cache[cache_key] = text
+            return text
+        except Exception:
+            logger.exception("General response generation failed")
             return (
                 "I'm here to help you with booking appointments and finding doctors. "
                 "Is there anything specific I can assist you with?"
@@ -1,25 +1,132 @@
 import os
+import json
+import logging
 import google.generativeai as genai
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
 from enum import Enum
+from keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
 
 class UrgencyLevel(Enum):
     EMERGENCY = "EMERGENCY"
     URGENT = "URGENT"
     ROUTINE = "ROUTINE"
 
+# Emergency keywords for quick detection before calling the model
+_EMERGENCY_KEYWORDS = KeywordMatcher({
+    UrgencyLevel.EMERGENCY.value: [
+        "chest pain", "difficulty breathing", "can't breathe", "severe bleeding",
+        "stroke", "unconscious", "seizure", "severe headache", "suicide",
+        "overdose", "severe burn", "choking", "heart attack"
+    ]
+})
+
+# Rule-based triage keywords, in priority order
+_FALLBACK_TRIAGE_KEYWORDS = KeywordMatcher({
+    UrgencyLevel.EMERGENCY.value: [
+        "chest pain", "difficulty breathing", "severe bleeding", "stroke",
+        "unconscious", "seizure", "heart attack"
+    ],
+    UrgencyLevel.URGENT.value: [
+        "high fever", "severe pain", "vomiting", "can't eat", "severe", "acute"
+    ]
+})
+
+# Rule-based triage result for each urgency level
+_FALLBACK_TRIAGE_RESULTS = {
+    UrgencyLevel.EMERGENCY.value: {
+        "urgency": UrgencyLevel.EMERGENCY.value,
+        "recommended_specialty": "Emergency Medicine",
+        "advice": "⚠️ EMERGENCY: Call emergency services immediately.",
+        "disclaimer": "This is an automated assessment. When in doubt, seek immediate medical attention."
+    },
+    UrgencyLevel.URGENT.value: {
+        "urgency": UrgencyLevel.URGENT.value,
+        "recommended_specialty": "General Practice",
+        "advice": "Please schedule an appointment within 24 hours.",
+        "disclaimer": "This is an automated assessment and does not replace professional medical diagnosis."
+    },
+    UrgencyLevel.ROUTINE.value: {
+        "urgency": UrgencyLevel.ROUTINE.value,
+        "recommended_specialty": "General Practice",
+        "advice": "Please schedule a regular appointment to discuss your symptoms.",
+        "disclaimer": "This is an automated assessment and does not replace professional medical diagnosis."
+    },
+}
+
+# Symptom phrases for each specialty, built once
+_SPECIALTY_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "Cardiology": ("chest pain", "heart", "palpitation", "irregular heartbeat", "shortness of breath"),
+    "Dermatology": ("skin", "rash", "acne", "mole", "itching", "eczema"),
+    "Orthopedics": ("bone", "joint", "fracture", "sprain", "back pain", "knee pain"),
+    "ENT": ("ear", "nose", "throat", "sinus", "hearing", "tinnitus"),
+    "Gastroenterology": ("stomach", "digestion", "abdominal pain", "diarrhea", "constipation"),
+    "Neurology": ("headache", "migraine", "dizziness", "numbness", "tingling"),
+    "Ophthalmology": ("eye", "vision", "blurry", "eye pain"),
+    "Psychiatry": ("anxiety", "depression", "stress", "mental health", "sleep problems"),
+}
+_SPECIALTY_KEYWORDS_VIEW = MappingProxyType(_SPECIALTY_KEYWORDS)
+
+# Sent once as the model's system instruction; each call only carries the symptoms
+TRIAGE_SYSTEM_INSTRUCTION = """You are a medical triage AI assistant. Analyze the user's symptoms and provide a triage recommendation.
+
+Based on the symptoms, provide:
+1. Urgency Level: EMERGENCY, URGENT, or ROUTINE
+2. Recommended Medical Specialty (e.g., Cardiology, Dermatology, General Practice, etc.)
+3. Brief advice (1-2 sentences)
+
+IMPORTANT Guidelines:
+- EMERGENCY: Life-threatening conditions requiring immediate care
+- URGENT: Serious conditions requiring care within 24 hours
+- ROUTINE: Non-urgent conditions that can be scheduled normally
+
+Respond with urgency, recommended_specialty and advice."""
+
+_URGENCY_LEVELS = frozenset(level.value for level in UrgencyLevel)
+
+# Gemini is asked for exactly this JSON object, so the reply needs no extraction;
+# it is still checked before use, since the schema is a request rather than a guarantee
+TRIAGE_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "OBJECT",
+        "properties": {
+            "urgency": {"type": "STRING", "enum": [level.value for level in UrgencyLevel]},
+            "recommended_specialty": {"type": "STRING"},
+            "advice": {"type": "STRING"},
+        },
+        "required": ["urgency", "recommended_specialty", "advice"],
+    },
+}
+
 class SymptomTriageService:
     """Analyzes symptoms and provides triage recommendations"""
     
-    def __init__(self):
+    def __init__(self, model: Optional[genai.GenerativeModel] = None):
+        """
+        Args:
+            model: Shared Gemini model built with TRIAGE_SYSTEM_INSTRUCTION and
+                TRIAGE_GENERATION_CONFIG; when omitted,
+                one is created here if GEMINI_API_KEY is set
+        """
+        if model is not None:
+            self.model = model
+            return
+        
         GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
         if GEMINI_API_KEY:
             genai.configure(api_key=GEMINI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = genai.GenerativeModel(
+                'gemini-1.5-flash',
+                system_instruction=TRIAGE_SYSTEM_INSTRUCTION,
+                generation_config=TRIAGE_GENERATION_CONFIG
+            )
         else:
             self.model = None
     
-    def analyze_symptoms(self, symptoms: str, additional_info: Optional[str] = None) -> Dict:
+    async def analyze_symptoms(self, symptoms: str, additional_info: Optional[str] = None) -> Dict:
         """
         Analyze symptoms and provide triage recommendation
         
@@ -33,17 +140,8 @@ class SymptomTriageService:
         if not self.model:
             return self._fallback_triage(symptoms)
         
-        # Emergency keywords for quick detection
-        emergency_keywords = [
-            "chest pain", "difficulty breathing", "can't breathe", "severe bleeding",
-            "stroke", "unconscious", "seizure", "severe headache", "suicide",
-            "overdose", "severe burn", "choking", "heart attack"
-        ]
-        
-        symptoms_lower = symptoms.lower()
-        
         # Immediate emergency detection
-        if any(keyword in symptoms_lower for keyword in emergency_keywords):
+        if _EMERGENCY_KEYWORDS.first(symptoms.lower()):
             return {
                 "urgency": UrgencyLevel.EMERGENCY.value,
                 "recommended_specialty": "Emergency Medicine",
@@ -53,30 +151,10 @@ class SymptomTriageService:
         
         # Use AI for nuanced analysis
         try:
-            prompt = f"""You are a medical triage AI assistant. Analyze the following symptoms and provide a triage recommendation.
-
-            Symptoms: {symptoms}
-            {f"Additional Information: {additional_info}" if additional_info else ""}
-
-            Based on these symptoms, provide:
-            1. Urgency Level: EMERGENCY, URGENT, or ROUTINE
-            2. Recommended Medical Specialty (e.g., Cardiology, Dermatology, General Practice, etc.)
-            3. Brief advice (1-2 sentences)
-
-            IMPORTANT Guidelines:
-            - EMERGENCY: Life-threatening conditions requiring immediate care
-            - URGENT: Serious conditions requiring care within 24 hours
-            - ROUTINE: Non-urgent conditions that can be scheduled normally
-
-            Respond in this exact JSON format:
-            {{
-                "urgency": "EMERGENCY/URGENT/ROUTINE",
-                "recommended_specialty": "Specialty Name",
-                "advice": "Your advice here"
-            }}
-            """
+            prompt = f"""Symptoms: {symptoms}
+{f"Additional Information: {additional_info}" if additional_info else ""}"""
             
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             result = self._parse_ai_response(response.text)
             
             # Add disclaimer
@@ -88,28 +166,22 @@ class SymptomTriageService:
             
             return result
             
-        except Exception as e:
-            print(f"Error in AI triage: {e}")
+        except Exception:
+            logger.exception("AI triage failed, using rules")
             return self._fallback_triage(symptoms)
     
     def _parse_ai_response(self, response_text: str) -> Dict:
-        """Parse AI response and extract triage information"""
-        import json
-        import re
+        """Parse the schema-constrained JSON reply, falling back to a routine referral if it's malformed"""
         
         try:
-            # Try to find JSON in response
-            json_match = re.search(r'\{[^}]+\}', response_text, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-                
-                # Validate urgency level
-                if result.get("urgency") not in ["EMERGENCY", "URGENT", "ROUTINE"]:
-                    result["urgency"] = "ROUTINE"
-                
+            result = json.loads(response_text)
+            if (isinstance(result, dict)
+                    and all(isinstance(result.get(k), str) for k in ("urgency", "recommended_specialty", "advice"))
+                    and result["urgency"] in _URGENCY_LEVELS):
                 return result
-        except Exception as e:
-            print(f"Error parsing AI response: {e}")
+            logger.warning("Malformed AI triage response: %r", response_text)
+        except Exception:
+            logger.exception("Error parsing AI triage response")
         
         # Fallback parsing
         return {
@@ -120,50 +192,10 @@ class SymptomTriageService:
     
     def _fallback_triage(self, symptoms: str) -> Dict:
         """Fallback triage using rule-based system"""
-        symptoms_lower = symptoms.lower()
-        
-        # Emergency keywords
-        emergency_keywords = [
-            "chest pain", "difficulty breathing", "severe bleeding", "stroke",
-            "unconscious", "seizure", "heart attack"
-        ]
-        
-        # Urgent keywords
-        urgent_keywords = [
-            "high fever", "severe pain", "vomiting", "can't eat", "severe", "acute"
-        ]
-        
-        if any(kw in symptoms_lower for kw in emergency_keywords):
-            return {
-                "urgency": UrgencyLevel.EMERGENCY.value,
-                "recommended_specialty": "Emergency Medicine",
-                "advice": "⚠️ EMERGENCY: Call emergency services immediately.",
-                "disclaimer": "This is an automated assessment. When in doubt, seek immediate medical attention."
-            }
-        elif any(kw in symptoms_lower for kw in urgent_keywords):
-            return {
-                "urgency": UrgencyLevel.URGENT.value,
-                "recommended_specialty": "General Practice",
-                "advice": "Please schedule an appointment within 24 hours.",
-                "disclaimer": "This is an automated assessment and does not replace professional medical diagnosis."
-            }
-        else:
-            return {
-                "urgency": UrgencyLevel.ROUTINE.value,
-                "recommended_specialty": "General Practice",
-                "advice": "Please schedule a regular appointment to discuss your symptoms.",
-                "disclaimer": "This is an automated assessment and does not replace professional medical diagnosis."
-            }
+        urgency = _FALLBACK_TRIAGE_KEYWORDS.first(symptoms.lower()) or UrgencyLevel.ROUTINE.value
+        # Copy so callers can annotate the result without touching the table
+        return dict(_FALLBACK_TRIAGE_RESULTS[urgency])
     
-    def get_specialty_keywords(self) -> Dict[str, List[str]]:
-        """Map symptoms to potential specialties"""
-        return {
-            "Cardiology": ["chest pain", "heart", "palpitation", "irregular heartbeat", "shortness of breath"],
-            "Dermatology": ["skin", "rash", "acne", "mole", "itching", "eczema"],
-            "Orthopedics": ["bone", "joint", "fracture", "sprain", "back pain", "knee pain"],
-            "ENT": ["ear", "nose", "throat", "sinus", "hearing", "tinnitus"],
-            "Gastroenterology": ["stomach", "digestion", "abdominal pain", "diarrhea", "constipation"],
-            "Neurology": ["headache", "migraine", "dizziness", "numbness", "tingling"],
-            "Ophthalmology": ["eye", "vision", "blurry", "eye pain"],
-            "Psychiatry": ["anxiety", "depression", "stress", "mental health", "sleep problems"]
-        }
+    def get_specialty_keywords(self) -> Mapping[str, Tuple[str, ...]]:
+        """Map symptoms to potential specialties (read-only, shared)"""
+        return _SPECIALTY_KEYWORDS_VIEW